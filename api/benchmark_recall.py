@@ -0,0 +1,77 @@
+"""Recall@k and memory of the profile index at each embedding precision.
+
+    python benchmark_recall.py              # embeddings from the profiles table
+    python benchmark_recall.py --synthetic 100000
+
+Queries are stored embeddings with Gaussian noise added; the exact answer is
+a brute-force float32 scan. ANN_* settings (IVF lists, probes) apply as usual,
+so the float32 row shows the recall of the IVF index alone.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from profile_index import ProfileIndex, decode_embeddings, recall_at_k
+
+PRECISIONS = ("float32", "float16", "int8")
+
+
+def load_embeddings():
+    from db import get_pool
+
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT embedding FROM profiles")
+        return decode_embeddings(row[0] for row in cur.fetchall())
+
+
+def make_queries(embeddings, n, noise, seed=0):
+    rng = np.random.default_rng(seed)
+    picked = embeddings[rng.choice(len(embeddings), min(n, len(embeddings)), replace=False)]
+    scale = noise * np.linalg.norm(picked, axis=1, keepdims=True) / np.sqrt(picked.shape[1])
+    return picked + rng.normal(size=picked.shape).astype(np.float32) * scale
+
+
+def run(embeddings, queries, k, rescore):
+    ids = np.arange(len(embeddings))
+    zeros = np.zeros(len(embeddings))
+    julds = [None] * len(embeddings)
+
+    def exact(profile_ids):
+        return embeddings[profile_ids]
+
+    print(f"{len(embeddings)} profiles x {embeddings.shape[1]} dims, "
+          f"{len(queries)} queries, k={k}")
+    print(f"{'precision':<10} {'rescore':>7} {'MiB':>8} {'saving':>7} {'recall':>7} {'ms/query':>9}")
+    baseline = None
+    for precision in PRECISIONS:
+        for factor in sorted({0, rescore}):
+            if factor and precision == "float32":
+                continue
+            index = ProfileIndex(ids, zeros, zeros, julds, embeddings,
+                                 precision=precision, rescore=factor, exact=exact)
+            baseline = baseline or index.nbytes()
+            start = time.perf_counter()
+            recall = recall_at_k(index, queries, k, embeddings)
+            per_query = (time.perf_counter() - start) * 1000 / len(queries)
+            print(f"{precision:<10} {factor:>7} {index.nbytes() / 2**20:>8.1f} "
+                  f"{baseline / index.nbytes():>6.1f}x {recall:>7.4f} {per_query:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="use this many random 384-dim embeddings instead of the database")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.5,
+                        help="query noise, relative to the embedding norm")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--rescore", type=int, default=4,
+                        help="candidates per result rescored exactly (0 = skip those rows)")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        embeddings = np.random.default_rng(1).normal(size=(args.synthetic, 384)).astype(np.float32)
+    else:
+        embeddings = load_embeddings()
+    run(embeddings, make_queries(embeddings, args.queries, args.noise), args.k, args.rescore)
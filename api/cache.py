@@ -0,0 +1,147 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional per-entry TTL (seconds) and
+    hit/miss counters."""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (self.ttl is None or entry[1] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def items(self):
+        """Live (key, value) pairs, least recently used first."""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (value, expires) in self._data.items()
+                    if expires is None or expires > now]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses}
+
+
+class SQLiteCache:
+    """Same interface as LRUCache, backed by a local SQLite file so entries
+    survive restarts and are shared by processes on one host. Values must
+    be strings."""
+
+    def __init__(self, path, maxsize=1024, ttl=None):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires REAL,
+                used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+        self._conn.commit()
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            self._conn.execute("UPDATE cache SET used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        expires = now + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires, used) VALUES (?, ?, ?, ?)",
+                (key, value, expires, now),
+            )
+            self._conn.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?", (now,))
+            self._conn.execute("""
+                DELETE FROM cache WHERE key IN (
+                    SELECT key FROM cache ORDER BY used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.maxsize,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self):
+        return {"size": len(self), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses, "path": self.path}
+
+
+def make_cache(backend="memory", path=None, maxsize=1024, ttl=None):
+    """An LRUCache ("memory") or a SQLiteCache at `path` ("sqlite")."""
+    if backend == "sqlite":
+        return SQLiteCache(path, maxsize=maxsize, ttl=ttl)
+    if backend == "memory":
+        return LRUCache(maxsize=maxsize, ttl=ttl)
+    raise ValueError(f"unknown cache backend: {backend!r}")
+
+
+def save_vectors(cache, path):
+    """Write a cache of equal-length vectors to an .npz file (atomically)."""
+    items = cache.items()
+    if not items:
+        return
+    keys, vectors = zip(*items)
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, keys=np.array(keys), vectors=np.stack(vectors))
+    os.replace(tmp_path, path)
+
+
+def load_vectors(cache, path):
+    if not os.path.exists(path):
+        return
+    with np.load(path) as saved:
+        for key, vector in zip(saved["keys"].tolist(), saved["vectors"]):
+            vector.flags.writeable = False
+            cache.set(key, vector)
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+DB_CONFIG = {
+    "host": "localhost",
+    "database": "floatchatai",
+    "user": "postgres",
+    "password": "Owais@786"
+}
+
+# Connections kept open / allowed at once, seconds a request waits for a free
+# connection, and idle seconds after which a connection is pinged before use.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))
+DB_POOL_HEALTHCHECK_SECONDS = float(os.getenv("DB_POOL_HEALTHCHECK_SECONDS", 30))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Process-wide pool of psycopg2 connections. Borrowers wait up to
+    `timeout` seconds for a free slot, connections idle for longer than
+    `healthcheck_after` are pinged before being handed out, and broken ones
+    are replaced."""
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 healthcheck_after=DB_POOL_HEALTHCHECK_SECONDS, **config):
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **(config or DB_CONFIG))
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self.timeout = timeout
+        self.healthcheck_after = healthcheck_after
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0) < self.healthcheck_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        conn = self._pool.getconn()
+        if not self._is_healthy(conn):
+            self._pool.putconn(conn, close=True)
+            conn = self._pool.getconn()
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; it is rolled back and returned afterwards."""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"no database connection free after {self.timeout}s")
+        try:
+            conn = self._checkout()
+            broken = False
+            try:
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                if not conn.closed and not broken:
+                    conn.rollback()
+                self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn, close=broken or bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+    return _pool
+
+
+def fetch_depth_levels(cur, profile_ids, limit=None):
+    """(pres, temp, psal) rows of every profile in `profile_ids`, shallowest
+    first and at most `limit` per profile, in one round trip. Served by the
+    (profile_id, n_levels) index on profile_levels."""
+    cur.execute("""
+        SELECT profile_id, pres, temp, psal
+        FROM (
+            SELECT profile_id, n_levels, pres, temp, psal,
+                   row_number() OVER (PARTITION BY profile_id ORDER BY n_levels) AS rn
+            FROM profile_levels
+            WHERE profile_id = ANY(%s)
+        ) levels
+        WHERE %s IS NULL OR rn <= %s
+        ORDER BY profile_id, n_levels
+    """, (list(profile_ids), limit, limit))
+    grouped = {profile_id: [] for profile_id in profile_ids}
+    for profile_id, pres, temp, psal in cur.fetchall():
+        grouped[profile_id].append((pres, temp, psal))
+    return grouped
+
+
+def fetch_embeddings(cur, profile_ids):
+    """Packed embeddings of `profile_ids`, one per id in the same order; None
+    for ids no longer in the table."""
+    cur.execute("""
+        SELECT p.embedding
+        FROM unnest(%s::bigint[]) WITH ORDINALITY AS wanted (id, pos)
+        LEFT JOIN profiles p ON p.id = wanted.id
+        ORDER BY wanted.pos
+    """, (list(profile_ids),))
+    return [row[0] for row in cur.fetchall()]
@@ -1,40 +1,20 @@
-import psycopg2
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from geopy.geocoders import Nominatim
-from geopy.distance import distance
+from db import fetch_depth_levels, get_pool
+from geocoding import geocode_place
+from profile_index import (bounding_box, bounding_box_sql, check_embedding_column, decode_embeddings,
+                           haversine_meters, normalize)
+from ranking import RADIUS_METERS, best_profiles
 import re
 import json
 
-DB_CONFIG = {
-    "host": "localhost",
-    "database": "floatchatai",
-    "user": "postgres",
-    "password": "Owais@786"
-}
-
 TOP_K = 3          
-RADIUS_METERS = 50_000 
 model = SentenceTransformer('all-MiniLM-L6-v2')  
 
 def get_embedding(text):
     """Convert user query to embedding vector."""
     return model.encode(text).tolist()
 
-def cosine_similarity(a, b):
-    """Compute cosine similarity between two lists."""
-    a = np.array(a)
-    b = np.array(b)
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
-def geocode_place(place_name):
-    """Convert a place name to (latitude, longitude) using Nominatim."""
-    geolocator = Nominatim(user_agent="floatchat")
-    location = geolocator.geocode(place_name)
-    if location:
-        return location.latitude, location.longitude
-    return None, None
-
 def extract_lat_lon(user_query):
     """Extract lat/long from query if present."""
     lat_match = re.search(r"lat\s*=\s*([-+]?\d*\.?\d+)", user_query, re.IGNORECASE)
@@ -45,63 +25,57 @@ def extract_lat_lon(user_query):
 
 def query_profiles(user_query):
     lat, lon = extract_lat_lon(user_query)
+    radius_m = RADIUS_METERS
 
     if lat is None or lon is None:
-        lat, lon = geocode_place(user_query)
+        lat, lon, place_radius = geocode_place(user_query)
+        radius_m = place_radius or RADIUS_METERS
 
     query_emb = get_embedding(user_query)
 
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-
-    cur.execute("SELECT id, latitude, longitude, juld, embedding FROM profiles")
-    profiles = cur.fetchall()
-    print(f"Total profiles fetched: {len(profiles)}")
-
-    sims = []
-    for profile in profiles:
-        profile_id, plat, plon, juld, emb = profile
-
-        if isinstance(emb, str):
-            emb = json.loads(emb)
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        check_embedding_column(cur)
 
+        sql = "SELECT id, latitude, longitude, juld, embedding FROM profiles WHERE embedding IS NOT NULL"
         if lat is not None and lon is not None:
-            dist = distance((lat, lon), (plat, plon)).meters
-            if dist > RADIUS_METERS:
-                continue
+            # Only profiles in the radius' bounding box leave the database.
+            where, params = bounding_box_sql(bounding_box(lat, lon, radius_m))
+            cur.execute(f"{sql} AND {where}", params)
         else:
-            dist = 0 
-
-        sim = cosine_similarity(query_emb, emb)
-
-       
-        distance_score = 1 / (1 + dist)  
-        combined_score = 0.7 * sim + 0.3 * distance_score
-
-        sims.append((profile_id, plat, plon, juld))
-
-    top_profiles = sorted(sims, key=lambda x: x[0], reverse=True)[:TOP_K]
-
-    results = []
-    for  profile_id, plat, plon, juld in top_profiles:
-        cur.execute("""
-            SELECT pres, temp, psal
-            FROM profile_levels
-            WHERE profile_id = %s
-            ORDER BY n_levels ASC
-        """, (profile_id,))
-        levels = cur.fetchall()
-
-        results.append({
-            "profile_id": profile_id,
-            "lat": plat,
-            "lon": plon,
-            "time": juld.strftime("%Y-%m-%d %H:%M:%S"),
-            "depth_levels": [{"pres": l[0], "temp": l[1], "salinity": l[2]} for l in levels],
-            "query_explain": f"Matched using weighted embedding similarity and proximity for: '{user_query}'"
-        })
-
-    conn.close()
+            cur.execute(sql)
+        profiles = cur.fetchall()
+        print(f"Total profiles fetched: {len(profiles)}")
+
+        dists = np.zeros(len(profiles))
+        if lat is not None and lon is not None and profiles:
+            plats = np.array([p[1] for p in profiles], dtype=float)
+            plons = np.array([p[2] for p in profiles], dtype=float)
+            dists = haversine_meters(lat, lon, plats, plons)
+        profiles = [p for p, dist in zip(profiles, dists) if dist <= radius_m]
+        dists = dists[dists <= radius_m]
+
+        top_profiles = []
+        if profiles:
+            ids, plats, plons, julds, embs = zip(*profiles)
+            sims = normalize(decode_embeddings(embs)) @ normalize(query_emb)
+            top_profiles = best_profiles(ids, plats, plons, julds, sims, dists, TOP_K)
+
+        levels_by_profile = fetch_depth_levels(cur, [p[1] for p in top_profiles])
+
+        results = []
+        for _, profile_id, plat, plon, juld in top_profiles:
+            levels = levels_by_profile[profile_id]
+
+            results.append({
+                "profile_id": profile_id,
+                "lat": plat,
+                "lon": plon,
+                "time": juld.strftime("%Y-%m-%d %H:%M:%S"),
+                "depth_levels": [{"pres": l[0], "temp": l[1], "salinity": l[2]} for l in levels],
+                "query_explain": f"Matched using weighted embedding similarity and proximity for: '{user_query}'"
+            })
+
     return results
 
 
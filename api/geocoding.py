@@ -0,0 +1,156 @@
+import difflib
+import json
+import os
+import re
+
+from cache import LRUCache
+
+# Local gazetteer of ports, seas, coastal cities and ocean basins, tried
+# before the remote geocoder. Fuzzy matches need at least GAZETTEER_FUZZY_CUTOFF
+# similarity; resolved names are cached for GEOCODE_CACHE_TTL seconds.
+# Seas carry their own search radius ("radius_m"); ocean basins are too large
+# to narrow a search, so naming one gives the query no location at all.
+GAZETTEER_PATH = os.getenv(
+    "GAZETTEER_PATH", os.path.join(os.path.dirname(__file__), "gazetteer.json")
+)
+GAZETTEER_FUZZY_CUTOFF = float(os.getenv("GAZETTEER_FUZZY_CUTOFF", 0.85))
+GEOCODE_REMOTE = os.getenv("GEOCODE_REMOTE", "1") == "1"
+GEOCODE_TIMEOUT = float(os.getenv("GEOCODE_TIMEOUT", 3))
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", 4096))
+GEOCODE_CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", 24 * 3600))
+
+# Phrases introduced by these words are the only text sent to the remote
+# geocoder; queries without one are not geocoded remotely at all.
+# The lookahead lets matches overlap, so a rejected phrase ("in summer near
+# goa") does not hide the one after it.
+PLACE_PHRASE = re.compile(
+    r"(?=\b(?:near|in|at|off|around)\s+(?:the\s+)?([a-z][a-z.'-]*(?:\s+[a-z][a-z.'-]*){0,3}))",
+    re.IGNORECASE,
+)
+FUZZY_MIN_LENGTH = 4
+
+# Phrases starting with one of these ("in march 2023", "at depth", "in
+# summer", "around noon") describe time or depth, not a place.
+NON_PLACE_WORDS = frozenset("""
+    january february march april may june july august september october
+    november december jan feb mar apr jun jul aug sep sept oct nov dec
+    spring summer autumn fall winter monsoon season seasons
+    depth depths deep shallow surface bottom pressure dbar meters metres
+    m km degrees
+    morning afternoon evening night noon midnight day days week weeks
+    month months year years today yesterday recent last past first
+    general total average particular this that these those all
+""".split())
+PHRASE_BREAKS = frozenset(["near", "in", "at", "off", "around", "during", "for", "from", "on", "with"])
+
+_cache = LRUCache(maxsize=GEOCODE_CACHE_SIZE, ttl=GEOCODE_CACHE_TTL)
+_remote = None
+
+
+def _normalize(text):
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+
+NO_LOCATION = (None, None, None)
+
+
+def load_gazetteer(path=GAZETTEER_PATH):
+    """Map of normalized name/alias -> (lat, lon, radius_m); radius_m is None
+    for point places (the caller's default radius applies) and basins map to
+    NO_LOCATION."""
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    names = {}
+    for entry in entries:
+        if entry.get("kind") == "basin":
+            location = NO_LOCATION
+        else:
+            location = (entry["lat"], entry["lon"], entry.get("radius_m"))
+        for name in [entry["name"], *entry.get("aliases", [])]:
+            names[_normalize(name)] = location
+    return names
+
+
+GAZETTEER = load_gazetteer()
+_NAMES_LONGEST_FIRST = sorted(GAZETTEER, key=len, reverse=True)
+_NAMES_BY_WORDS = {}
+for _name in GAZETTEER:
+    _NAMES_BY_WORDS.setdefault(len(_name.split()), []).append(_name)
+
+
+def match_gazetteer(text):
+    """(lat, lon, radius_m) of the place named in `text`, or None when no
+    name matches: the longest exact name first, then the closest fuzzy match
+    over word n-grams."""
+    query = _normalize(text)
+    padded = f" {query} "
+    for name in _NAMES_LONGEST_FIRST:
+        if f" {name} " in padded:
+            return GAZETTEER[name]
+
+    words = query.split()
+    best, best_ratio = None, GAZETTEER_FUZZY_CUTOFF
+    for n, names in _NAMES_BY_WORDS.items():
+        for i in range(len(words) - n + 1):
+            gram = " ".join(words[i:i + n])
+            if len(gram) < FUZZY_MIN_LENGTH:
+                continue
+            for name in difflib.get_close_matches(gram, names, n=1, cutoff=best_ratio):
+                ratio = difflib.SequenceMatcher(None, gram, name).ratio()
+                if ratio >= best_ratio:
+                    best, best_ratio = name, ratio
+    return GAZETTEER[best] if best else None
+
+
+def place_phrase(text):
+    """The first phrase in `text` introduced by near/in/at/... that could name
+    a place, cut before any time/depth word or further preposition, or None."""
+    for match in PLACE_PHRASE.finditer(text):
+        words = []
+        for word in match.group(1).split():
+            if word.lower() in NON_PLACE_WORDS or word.lower() in PHRASE_BREAKS:
+                break
+            words.append(word)
+        if words:
+            return " ".join(words)
+    return None
+
+
+def geocode_remote(text):
+    global _remote
+    phrase = place_phrase(text)
+    if not GEOCODE_REMOTE or phrase is None:
+        return NO_LOCATION
+    from geopy.geocoders import Nominatim
+
+    if _remote is None:
+        _remote = Nominatim(user_agent="floatchat", timeout=GEOCODE_TIMEOUT)
+    location = _remote.geocode(phrase)
+    if location:
+        return location.latitude, location.longitude, None
+    return NO_LOCATION
+
+
+def geocode_place(place_name):
+    """Resolve the place named in a query to (lat, lon, radius_m): cache, then
+    gazetteer, then (if enabled) the remote geocoder. radius_m is None when
+    the caller's default search radius applies; a query naming no usable
+    place gets NO_LOCATION. Misses are cached too."""
+    key = _normalize(place_name)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+
+    location = match_gazetteer(place_name)
+    if location is None:
+        try:
+            location = geocode_remote(place_name)
+        except Exception:
+            # An unreachable geocoder only means the query has no location.
+            return NO_LOCATION
+    _cache.set(key, location)
+    return location
+
+
+def cache_stats():
+    return _cache.stats()
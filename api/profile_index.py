@@ -0,0 +1,300 @@
+import os
+
+import numpy as np
+
+# IVF (inverted file) index: profiles are clustered around ANN_NLIST centroids
+# (0 = sqrt of the profile count) and a query only scores the profiles in its
+# ANN_NPROBE closest clusters (0 = max(8, nlist // 8), about an eighth of the
+# index at any size). Below ANN_MIN_PROFILES every profile is scored.
+# nprobe trades recall for latency: a query costs roughly nprobe / nlist of a
+# full scan, and recall falls as that fraction shrinks, more so the less
+# clustered the embeddings are. Measure with benchmark_recall.py before
+# lowering it; ANN_NPROBE=ANN_NLIST is an exact (but slower) scan.
+ANN_NLIST = int(os.getenv("ANN_NLIST", 0))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", 0))
+ANN_MIN_PROFILES = int(os.getenv("ANN_MIN_PROFILES", 5000))
+# Stored precision of the embedding matrix: "float32", "float16" (half the
+# memory) or "int8" (a quarter, plus one float32 scale per profile). With
+# ANN_RESCORE > 0 and an exact loader, the best k * ANN_RESCORE candidates of a
+# quantized index are rescored against their float32 embeddings.
+ANN_PRECISION = os.getenv("ANN_PRECISION", "float32")
+ANN_RESCORE = int(os.getenv("ANN_RESCORE", 0))
+EARTH_RADIUS_METERS = 6_371_008.8
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 256  # training vectors per centroid
+ASSIGN_BATCH = 65536
+BATCH_SCORE_CELLS = 1 << 24  # query x profile similarities held at once by search_batch
+# profiles.embedding is bytea of packed little-endian float32 (see ingestion).
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+
+def top_k(scores, k):
+    """Indices of the k largest scores, best first, without a full sort."""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+def haversine_meters(lat, lon, lats, lons):
+    """Great-circle distance from (lat, lon) to each of lats/lons, in meters."""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def bounding_box(lat, lon, radius_m):
+    """(min_lat, max_lat, min_lon, max_lon) enclosing the circle of radius_m.
+    The longitude bounds may lie outside [-180, 180] when the box crosses the
+    antimeridian, and span all longitudes when it reaches a pole."""
+    dlat = float(np.degrees(radius_m / EARTH_RADIUS_METERS))
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    dlon = float(np.degrees(np.arcsin(np.sin(radius_m / EARTH_RADIUS_METERS) / np.cos(np.radians(lat)))))
+    return min_lat, max_lat, lon - dlon, lon + dlon
+
+
+def in_bounding_box(lats, lons, box):
+    min_lat, max_lat, min_lon, max_lon = box
+    return ((lats >= min_lat) & (lats <= max_lat)
+            & (np.mod(lons - min_lon, 360) <= max_lon - min_lon))
+
+
+def bounding_box_sql(box):
+    """SQL predicate (and its parameters) selecting profiles inside `box`,
+    answerable from the (latitude, longitude) index on profiles."""
+    min_lat, max_lat, min_lon, max_lon = box
+    sql, params = "latitude BETWEEN %s AND %s", [min_lat, max_lat]
+    if min_lon <= -180 and max_lon >= 180:
+        return sql, params
+    if min_lon < -180:
+        sql += " AND (longitude >= %s OR longitude <= %s)"
+        params += [min_lon + 360, max_lon]
+    elif max_lon > 180:
+        sql += " AND (longitude >= %s OR longitude <= %s)"
+        params += [min_lon, max_lon - 360]
+    else:
+        sql += " AND longitude BETWEEN %s AND %s"
+        params += [min_lon, max_lon]
+    return sql, params
+
+
+def decode_embedding(value):
+    """Zero-copy float32 view of one packed embedding."""
+    return np.frombuffer(value, dtype=EMBEDDING_DTYPE)
+
+
+def decode_embeddings(values):
+    """(n, dim) float32 matrix from packed embeddings, decoded in one pass."""
+    values = list(values)
+    if not values:
+        return np.empty((0, 0), dtype=EMBEDDING_DTYPE)
+    return np.frombuffer(b"".join(values), dtype=EMBEDDING_DTYPE).reshape(len(values), -1)
+
+
+def check_embedding_column(cur):
+    """Raise unless profiles.embedding is packed float32 bytea. Older
+    databases are converted by ingestion's ensure_schema."""
+    cur.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'profiles' AND column_name = 'embedding'
+    """)
+    row = cur.fetchone()
+    if row is None or row[0] != "bytea":
+        found = row[0] if row else "missing"
+        raise RuntimeError(
+            f"profiles.embedding is {found}, not packed float32 bytea; run the "
+            "ingestion (ensure_schema) migration before starting the API"
+        )
+
+
+def normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def quantize(vectors, precision=ANN_PRECISION):
+    """(matrix, scales) storing normalized float32 `vectors` at `precision`.
+    int8 keeps round(v / s) with s = max|v| / 127 per vector; the other
+    precisions have no scales."""
+    if precision == "float32":
+        return vectors, None
+    if precision == "float16":
+        return vectors.astype(np.float16), None
+    if precision == "int8":
+        scales = np.abs(vectors).max(axis=1, initial=0) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"unknown embedding precision: {precision!r}")
+
+
+def _assign(vectors, centroids):
+    """Index of the most similar centroid for each row, in bounded batches."""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BATCH):
+        batch = vectors[start:start + ASSIGN_BATCH]
+        labels[start:start + ASSIGN_BATCH] = np.argmax(batch @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(vectors, nlist, seed=0):
+    """Spherical k-means on a sample of the (normalized) vectors."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * KMEANS_SAMPLE)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        labels = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        empty = ~sums.any(axis=1)
+        sums[empty] = centroids[empty]
+        centroids = normalize(sums)
+    return centroids
+
+
+class ProfileIndex:
+    """Profile metadata plus an approximate nearest-neighbour index over the
+    profile embeddings, held in memory and built once from the profiles table."""
+
+    def __init__(self, ids, lats, lons, julds, embeddings, nlist=ANN_NLIST, nprobe=ANN_NPROBE,
+                 precision=ANN_PRECISION, rescore=ANN_RESCORE, exact=None):
+        self.ids = np.asarray(ids)
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.julds = np.asarray(julds, dtype=object)
+        self.nprobe = nprobe
+        self.centroids = None
+        self.lists = None
+        # exact(ids) -> float32 embedding (or None if deleted) per id, for rescoring.
+        self.exact = exact if precision != "float32" else None
+        self.rescore = rescore
+
+        embeddings = normalize(embeddings)
+        if len(self.ids) >= ANN_MIN_PROFILES:
+            nlist = nlist or int(np.sqrt(len(self.ids)))
+            self.nprobe = nprobe or max(8, nlist // 8)
+            self.centroids = train_centroids(embeddings, nlist)
+            labels = _assign(embeddings, self.centroids)
+            order = np.argsort(labels, kind="stable")
+            bounds = np.searchsorted(labels[order], np.arange(nlist + 1))
+            self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(nlist)]
+        self.embeddings, self.scales = quantize(embeddings, precision)
+
+    @classmethod
+    def from_db(cls, cur, **kwargs):
+        check_embedding_column(cur)
+        cur.execute(
+            "SELECT id, latitude, longitude, juld, embedding FROM profiles WHERE embedding IS NOT NULL"
+        )
+        rows = cur.fetchall()
+        if not rows:
+            return cls([], [], [], [], np.empty((0, 0), dtype=np.float32), **kwargs)
+        ids, lats, lons, julds, embeddings = zip(*rows)
+        return cls(ids, lats, lons, julds, decode_embeddings(embeddings), **kwargs)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def candidates(self, query):
+        """Rows in the ANN_NPROBE clusters closest to a normalized `query`."""
+        nprobe = min(self.nprobe, len(self.lists))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.lists[i] for i in probe])
+
+    def within_radius(self, lat, lon, radius_m):
+        """Rows within radius_m of (lat, lon) and their distances: a bounding-box
+        prefilter, then haversine on the rows left."""
+        rows = np.flatnonzero(in_bounding_box(self.lats, self.lons, bounding_box(lat, lon, radius_m)))
+        dists = haversine_meters(lat, lon, self.lats[rows], self.lons[rows])
+        keep = dists <= radius_m
+        return rows[keep], dists[keep]
+
+    def nbytes(self):
+        """Memory held by the embedding matrix and its scales."""
+        return self.embeddings.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+    def similarities(self, query, rows=None):
+        """Cosine similarity of a normalized `query` (or a matrix of queries,
+        one per row) to `rows` (every profile when None), computed from the
+        stored precision in bounded batches."""
+        matrix = self.embeddings if rows is None else self.embeddings[rows]
+        if matrix.dtype == np.float32:
+            sims = query @ matrix.T
+        else:
+            sims = np.empty(query.shape[:-1] + (len(matrix),), dtype=np.float32)
+            for start in range(0, len(matrix), ASSIGN_BATCH):
+                block = matrix[start:start + ASSIGN_BATCH].astype(np.float32)
+                sims[..., start:start + ASSIGN_BATCH] = query @ block.T
+        if self.scales is not None:
+            sims *= self.scales if rows is None else self.scales[rows]
+        return sims
+
+    def refine(self, rows, sims, query, k, ranking=None):
+        """Positions into `rows` worth keeping and their similarities: the best
+        k * rescore by `ranking` (default: the quantized similarity), rescored
+        exactly, when rescoring is on; otherwise every position, unchanged.
+        Candidates the exact loader no longer has (deleted since the index
+        was built) are dropped."""
+        if self.exact is None or self.rescore <= 0 or len(rows) == 0:
+            return np.arange(len(rows)), sims
+        keep = top_k(sims if ranking is None else ranking, k * self.rescore)
+        vectors = self.exact(self.ids[rows[keep]].tolist())
+        found = [i for i, vector in enumerate(vectors) if vector is not None]
+        if not found:
+            return keep[:0], sims[:0]
+        exact = normalize(np.stack([vectors[i] for i in found]))
+        return keep[found], exact @ query
+
+    def search(self, query_emb, k):
+        """Approximate top-k rows by cosine similarity, as (row, similarity) pairs."""
+        if len(self.ids) == 0:
+            return []
+        query = normalize(query_emb)
+        if self.lists is None:
+            rows = np.arange(len(self.ids))
+            sims = self.similarities(query)
+        else:
+            rows = self.candidates(query)
+            sims = self.similarities(query, rows)
+        keep, sims = self.refine(rows, sims, query, k)
+        rows = rows[keep]
+        best = top_k(sims, k)
+        return list(zip(rows[best].tolist(), sims[best].tolist()))
+
+    def search_batch(self, query_embs, k):
+        """search() for each row of `query_embs`. Without IVF lists, blocks
+        of queries are scored with one matrix-matrix product each."""
+        queries = normalize(query_embs)
+        if len(self.ids) == 0:
+            return [[] for _ in queries]
+        if self.lists is not None:
+            return [self.search(query, k) for query in queries]
+
+        rows = np.arange(len(self.ids))
+        block_size = max(1, BATCH_SCORE_CELLS // len(self.ids))
+        results = []
+        for start in range(0, len(queries), block_size):
+            block = queries[start:start + block_size]
+            for query, sims in zip(block, self.similarities(block)):
+                keep, sims = self.refine(rows, sims, query, k)
+                best = top_k(sims, k)
+                results.append(list(zip(rows[keep][best].tolist(), sims[best].tolist())))
+        return results
+
+
+def recall_at_k(index, queries, k, exact_embeddings):
+    """Mean fraction of the exact top-k (brute force over float32
+    `exact_embeddings`) that `index.search` returns, over `queries`."""
+    exact = normalize(exact_embeddings)
+    found = 0
+    for query in normalize(queries):
+        truth = set(top_k(exact @ query, k).tolist())
+        found += len(truth.intersection(row for row, _ in index.search(query, k)))
+    return found / (len(queries) * min(k, len(exact)))
@@ -1,28 +1,26 @@
-from flask import Flask, request, jsonify
-import psycopg2
+from flask import Flask, Response, request, jsonify, stream_with_context
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from geopy.geocoders import Nominatim
-from geopy.distance import distance
 import google.generativeai as genai
+import atexit
 import re
 import json
 import math
 import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from dotenv import load_dotenv
 from flask_cors import CORS
+from db import fetch_depth_levels, fetch_embeddings, get_pool
+from cache import LRUCache, load_vectors, make_cache, save_vectors
+from geocoding import cache_stats as geocoding_cache_stats, geocode_place
+from profile_index import ProfileIndex, decode_embedding
+from ranking import rank_profiles, rank_profiles_batch
 
 
 load_dotenv()
-DB_CONFIG = {
-    "host": "localhost",
-    "database": "floatchatai",
-    "user": "postgres",
-    "password": "Owais@786"
-}
 
 TOP_K = 1
-RADIUS_METERS = 50_000
 model = SentenceTransformer("all-MiniLM-L6-v2")
 
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
@@ -32,10 +30,112 @@ load_dotenv(dotenv_path)
 
 print("Loaded Gemini API key:", os.getenv("GOOGLE_API_KEY"))
 
+_profile_index = None
+_profile_index_lock = Lock()
+
+# Most queries accepted by one /query/batch request.
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", 500))
+
+# Query embeddings are cached by normalized text (the encoder is uncased);
+# with EMBED_CACHE_PATH set the cache is saved on exit and reloaded on start.
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", 10000))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "")
+_embedding_cache = LRUCache(maxsize=EMBED_CACHE_SIZE)
+if EMBED_CACHE_PATH:
+    load_vectors(_embedding_cache, EMBED_CACHE_PATH)
+    atexit.register(save_vectors, _embedding_cache, EMBED_CACHE_PATH)
+
+
+# Generated explanations are cached in memory or in a local SQLite file.
+# Bump EXPLAIN_PROMPT_VERSION whenever the prompt in build_prompt
+# changes, so stale explanations are not served.
+EXPLAIN_PROMPT_VERSION = 1
+EXPLAIN_CACHE_BACKEND = os.getenv("EXPLAIN_CACHE_BACKEND", "memory")
+EXPLAIN_CACHE_PATH = os.getenv("EXPLAIN_CACHE_PATH", "explain_cache.sqlite3")
+EXPLAIN_CACHE_SIZE = int(os.getenv("EXPLAIN_CACHE_SIZE", 5000))
+EXPLAIN_CACHE_TTL = float(os.getenv("EXPLAIN_CACHE_TTL", 7 * 24 * 3600))
+_explain_cache = make_cache(EXPLAIN_CACHE_BACKEND, EXPLAIN_CACHE_PATH,
+                            maxsize=EXPLAIN_CACHE_SIZE, ttl=EXPLAIN_CACHE_TTL)
+
+# Explanations missing from the cache are generated concurrently, with at
+# most EXPLAIN_WORKERS Gemini calls in flight across all requests.
+EXPLAIN_WORKERS = int(os.getenv("EXPLAIN_WORKERS", 4))
+_explain_pool = ThreadPoolExecutor(max_workers=EXPLAIN_WORKERS, thread_name_prefix="explain")
+
+
+def normalize_query(text):
+    return " ".join(text.lower().split())
+
+
 def get_embedding(text):
-    return model.encode(text).tolist()
+    """Query embedding, served from the LRU cache keyed on normalized text."""
+    key = normalize_query(text)
+    emb = _embedding_cache.get(key)
+    if emb is None:
+        emb = model.encode(key).astype(np.float32)
+        emb.flags.writeable = False
+        _embedding_cache.set(key, emb)
+    return emb
+
+
+def get_embeddings(texts):
+    """get_embedding for many texts; the cache misses are encoded together in
+    one model call."""
+    keys = [normalize_query(text) for text in texts]
+    embs = {key: _embedding_cache.get(key) for key in keys}
+    missing = [key for key, emb in embs.items() if emb is None]
+    if missing:
+        for key, emb in zip(missing, model.encode(missing).astype(np.float32)):
+            emb.flags.writeable = False
+            _embedding_cache.set(key, emb)
+            embs[key] = emb
+    return np.stack([embs[key] for key in keys])
+
+
+def explain_cache_key(user_query, profile_data):
+    return f"v{EXPLAIN_PROMPT_VERSION}:{profile_data['profile_id']}:{normalize_query(user_query)}"
+
+
+def llm_explain_many(pairs):
+    """Gemini explanation for each (user_query, profile_data) pair, cached per
+    (normalized query, profile, prompt version). The cache misses are
+    generated concurrently on the explanation pool, so several profiles cost
+    about one Gemini round trip."""
+    keys = [explain_cache_key(user_query, profile_data) for user_query, profile_data in pairs]
+    explanations = {key: _explain_cache.get(key) for key in keys}
+    pending = {
+        key: _explain_pool.submit(generate_explanation, *pair)
+        for key, pair in zip(keys, pairs) if explanations[key] is None
+    }
+    for key, future in pending.items():
+        explanations[key] = future.result()
+        _explain_cache.set(key, explanations[key])
+    return [explanations[key] for key in keys]
+
+
+def stream_explanation(user_query, profile_data):
+    """Like llm_explain_many for one profile, but yields the explanation in pieces as Gemini
+    produces them. A cached explanation is yielded whole."""
+    key = explain_cache_key(user_query, profile_data)
+    explanation = _explain_cache.get(key)
+    if explanation is not None:
+        yield explanation
+        return
+
+    parts = []
+    for chunk in gemini_model.generate_content(build_prompt(user_query, profile_data), stream=True):
+        if chunk.text:
+            parts.append(chunk.text)
+            yield chunk.text
+    _explain_cache.set(key, "".join(parts).strip())
+
+
+def generate_explanation(user_query, profile_data):
+    response = gemini_model.generate_content(build_prompt(user_query, profile_data))
+    return response.text.strip()
 
-def llm_explain(user_query, profile_data):
+
+def build_prompt(user_query, profile_data):
     summary = f"Profile at lat={profile_data['lat']}, lon={profile_data['lon']} on {profile_data['time']}. Depth levels:\n"
     for lvl in profile_data["depth_levels"]:
         summary += f"- Pressure: {lvl['pres']} dbar, Temp: {lvl['temp']}°C, Salinity: {lvl['salinity']}\n"
@@ -49,23 +149,7 @@ Here's a friendly explanation of the ocean data I found:
 
 In simple terms, describe what the ocean conditions are like here, relate it to the user's question, and keep it short, clear, and conversational – like you're chatting with the user. You can add emojis if it feels natural.
 """
-
-    response = gemini_model.generate_content(prompt)
-    return response.text.strip()
-
-
-def cosine_similarity(a, b):
-    a = np.array(a)
-    b = np.array(b)
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
-
-def geocode_place(place_name):
-    geolocator = Nominatim(user_agent="floatchat")
-    location = geolocator.geocode(place_name)
-    if location:
-        return location.latitude, location.longitude
-    return None, None
+    return prompt
 
 
 def extract_lat_lon(user_query):
@@ -76,94 +160,228 @@ def extract_lat_lon(user_query):
     return None, None
 
 
-def query_profiles(user_query):
+def locate(user_query):
+    """(lat, lon, radius_m) given in the query, else of the place it names,
+    else Nones. radius_m is None for the default search radius."""
     lat, lon = extract_lat_lon(user_query)
     if lat is None or lon is None:
-        lat, lon = geocode_place(user_query)
-
+        return geocode_place(user_query)
+    return lat, lon, None
+
+
+def load_exact_embeddings(profile_ids):
+    """float32 embeddings of `profile_ids` (None for deleted profiles), for
+    rescoring a quantized index."""
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        packed = fetch_embeddings(cur, profile_ids)
+    return [None if emb is None else decode_embedding(emb) for emb in packed]
+
+
+def load_profile_index():
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        return ProfileIndex.from_db(cur, exact=load_exact_embeddings)
+
+
+def get_profile_index():
+    """The in-memory profile index, loaded from the profiles table on first use."""
+    global _profile_index
+    with _profile_index_lock:
+        if _profile_index is None:
+            _profile_index = load_profile_index()
+    return _profile_index
+
+
+def refresh_profile_index():
+    """Reload the index from the table; requests keep using the old one until
+    the new one is ready."""
+    global _profile_index
+    index = load_profile_index()
+    with _profile_index_lock:
+        _profile_index = index
+    return index
+
+
+def with_depth_levels(ranked_lists):
+    """Result dicts for each list of ranked profiles; the depth levels of all
+    of them are fetched in one query."""
+    profile_ids = sorted({p[1] for ranked in ranked_lists for p in ranked})
+    levels_by_profile = {}
+    if profile_ids:
+        # Hold the pooled connection only for the level lookup, not the LLM calls.
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            levels_by_profile = fetch_depth_levels(cur, profile_ids, limit=15)
+
+    all_results = []
+    for ranked in ranked_lists:
+        results = []
+        for _, profile_id, plat, plon, juld in ranked:
+            depth_levels = []
+            for pres, temp, sal in levels_by_profile[profile_id]:
+                if pres is None or temp is None or sal is None:
+                    continue
+                if math.isnan(pres) or math.isnan(temp) or math.isnan(sal):
+                    continue
+                depth_levels.append({"pres": pres, "temp": temp, "salinity": sal})
+
+            results.append({
+                "profile_id": profile_id,
+                "lat": plat,
+                "lon": plon,
+                "time": juld.strftime("%Y-%m-%d %H:%M:%S"),
+                "depth_levels": depth_levels
+            })
+        all_results.append(results)
+    return all_results
+
+
+def retrieve_profiles(user_query):
+    """Top profiles for the query with their depth levels, without explanations."""
+    lat, lon, radius_m = locate(user_query)
     query_emb = get_embedding(user_query)
-
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-
-    cur.execute("SELECT id, latitude, longitude, juld, embedding FROM profiles")
-    profiles = cur.fetchall()
-
-    sims = []
-    for profile in profiles:
-        profile_id, plat, plon, juld, emb = profile
-        if isinstance(emb, str):
-            emb = json.loads(emb)
-
-        if lat is not None and lon is not None:
-            dist = distance((lat, lon), (plat, plon)).meters
-            if dist > RADIUS_METERS:
-                continue
-        else:
-            dist = 0
-
-        sim = cosine_similarity(query_emb, emb)
-        distance_score = 1 / (1 + dist)
-        combined_score = 0.7 * sim + 0.3 * distance_score
-        sims.append((combined_score, profile_id, plat, plon, juld))
-
-    top_profiles = sorted(sims, key=lambda x: x[0], reverse=True)[:TOP_K]
-
-    results = []
-    for _, profile_id, plat, plon, juld in top_profiles:
-        cur.execute("""
-            SELECT pres, temp, psal
-            FROM profile_levels
-            WHERE profile_id = %s
-            ORDER BY n_levels ASC
-            LIMIT 15
-        """, (profile_id,))
-        levels = cur.fetchall()
-
-        depth_levels = []
-        for l in levels:
-            pres, temp, sal = l
-            if pres is None or temp is None or sal is None:
-                continue
-            if math.isnan(pres) or math.isnan(temp) or math.isnan(sal):
-                continue
-            depth_levels.append({"pres": pres, "temp": temp, "salinity": sal})
-
-        profile_data = {
-            "profile_id": profile_id,
-            "lat": plat,
-            "lon": plon,
-            "time": juld.strftime("%Y-%m-%d %H:%M:%S"),
-            "depth_levels": depth_levels
-        }
-        profile_data["query_explain"] = llm_explain(user_query, profile_data)
-        results.append(profile_data)
-
-    conn.close()
+    top_profiles = rank_profiles(get_profile_index(), query_emb, lat, lon, TOP_K, radius_m)
+    return with_depth_levels([top_profiles])[0]
+
+
+def retrieve_profiles_batch(user_queries):
+    """retrieve_profiles for many queries: one encoder call, one scoring pass
+    for the queries without a location, and one depth-level query."""
+    locations = [locate(user_query) for user_query in user_queries]
+    ranked = rank_profiles_batch(get_profile_index(), get_embeddings(user_queries), locations, TOP_K)
+    return with_depth_levels(ranked)
+
+
+def query_profiles(user_query, explain=True):
+    """Ranked profiles for the query; with explain=False this is retrieval
+    only and never calls the LLM."""
+    results = retrieve_profiles(user_query)
+    if explain:
+        explanations = llm_explain_many([(user_query, profile_data) for profile_data in results])
+        for profile_data, explanation in zip(results, explanations):
+            profile_data["query_explain"] = explanation
     return results
 
 
+def query_profiles_batch(user_queries, explain=True):
+    """Per-query results for a list of queries, in order; explanations are
+    skipped with explain=False."""
+    batch = [
+        {"query": user_query, "results": results}
+        for user_query, results in zip(user_queries, retrieve_profiles_batch(user_queries))
+    ]
+    if explain:
+        pairs = [(entry["query"], profile_data) for entry in batch for profile_data in entry["results"]]
+        for (_, profile_data), explanation in zip(pairs, llm_explain_many(pairs)):
+            profile_data["query_explain"] = explanation
+    return batch
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_query(user_query, explain=True):
+    """Server-sent events for one query: `profiles` as soon as retrieval is
+    done, then (unless explain=False) `explanation` pieces per profile,
+    `explanation_done` with the full text, and finally `done` (or `error`)."""
+    try:
+        results = retrieve_profiles(user_query)
+        yield sse("profiles", results)
+        for profile_data in results if explain else []:
+            parts = []
+            for text in stream_explanation(user_query, profile_data):
+                parts.append(text)
+                yield sse("explanation", {"profile_id": profile_data["profile_id"], "text": text})
+            yield sse("explanation_done", {"profile_id": profile_data["profile_id"],
+                                           "query_explain": "".join(parts).strip()})
+        yield sse("done", {})
+    except Exception as e:
+        yield sse("error", {"error": str(e)})
+
+
+def parse_flag(value, default=True):
+    """A boolean request option given as JSON or as a query-string value."""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() not in ("0", "false", "no", "off", "")
+    return bool(value)
+
+
 app = Flask(__name__)
 
 @app.route("/query", methods=["POST"])
 def query():
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     user_query = data.get("query")
     if not user_query:
         return jsonify({"error": "Missing 'query' field"}), 400
+    explain = parse_flag(data.get("explain", request.args.get("explain")))
 
     try:
-        results = query_profiles(user_query)
+        results = query_profiles(user_query, explain=explain)
         return jsonify(results)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/query/batch", methods=["POST"])
+def query_batch():
+    data = request.get_json(silent=True) or {}
+    user_queries = data.get("queries")
+    if (not isinstance(user_queries, list) or not user_queries
+            or not all(isinstance(q, str) and q for q in user_queries)):
+        return jsonify({"error": "'queries' must be a non-empty list of query strings"}), 400
+    if len(user_queries) > BATCH_MAX_QUERIES:
+        return jsonify({"error": f"At most {BATCH_MAX_QUERIES} queries per batch"}), 400
+
+    try:
+        results = query_profiles_batch(user_queries, explain=parse_flag(data.get("explain")))
+        return jsonify(results)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/query/stream", methods=["GET", "POST"])
+def query_stream():
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+    else:
+        data = request.args
+    user_query = data.get("query")
+    if not user_query:
+        return jsonify({"error": "Missing 'query' field"}), 400
+
+    return Response(
+        stream_with_context(stream_query(user_query, explain=parse_flag(data.get("explain")))),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/index/refresh", methods=["POST"])
+def refresh_index():
+    try:
+        index = refresh_profile_index()
+        return jsonify({"profiles": len(index)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify({
+        "query_embeddings": _embedding_cache.stats(),
+        "geocoding": geocoding_cache_stats(),
+        "explanations": _explain_cache.stats(),
+    })
+
+
 @app.route("/", methods=["GET"])
 def home():
     return jsonify({"message": "FloatChat API is running 🚀"})
 
 
 if __name__ == "__main__":
+    get_profile_index()
     app.run(debug=True)
 CORS(app)
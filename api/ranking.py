@@ -0,0 +1,66 @@
+import numpy as np
+
+from profile_index import normalize, top_k
+
+# Location-bound queries only consider profiles within RADIUS_METERS; every
+# candidate is scored by a weighted sum of embedding similarity and proximity.
+RADIUS_METERS = 50_000
+SIMILARITY_WEIGHT = 0.7
+DISTANCE_WEIGHT = 0.3
+
+
+def combined_scores(sims, dists):
+    return SIMILARITY_WEIGHT * sims + DISTANCE_WEIGHT / (1 + dists)
+
+
+def best_profiles(ids, lats, lons, julds, sims, dists, k):
+    """Top-k (score, profile_id, lat, lon, juld) by combined score, from
+    aligned per-profile arrays."""
+    scores = combined_scores(sims, dists)
+    return [
+        (float(scores[i]), int(ids[i]), float(lats[i]), float(lons[i]), julds[i])
+        for i in top_k(scores, k)
+    ]
+
+
+def _best_rows(index, rows, sims, dists, k):
+    return best_profiles(index.ids[rows], index.lats[rows], index.lons[rows],
+                         index.julds[rows], sims, dists, k)
+
+
+def ranked_from_search(index, found, k):
+    """best_profiles for (row, similarity) pairs from index.search."""
+    rows = np.array([row for row, _ in found], dtype=np.int64)
+    sims = np.array([sim for _, sim in found], dtype=np.float32)
+    return _best_rows(index, rows, sims, np.zeros(len(rows)), k)
+
+
+def rank_profiles(index, query_emb, lat, lon, k, radius_m=None):
+    """Top-k profiles of a ProfileIndex for one query. Location-bound queries
+    score every profile within radius_m (default RADIUS_METERS) exactly; the
+    rest go through the ANN index."""
+    if len(index) == 0:
+        return []
+    if lat is None or lon is None:
+        return ranked_from_search(index, index.search(query_emb, k), k)
+
+    query = normalize(query_emb)
+    rows, dists = index.within_radius(lat, lon, radius_m or RADIUS_METERS)
+    sims = index.similarities(query, rows)
+    keep, sims = index.refine(rows, sims, query, k, ranking=combined_scores(sims, dists))
+    return _best_rows(index, rows[keep], sims, dists[keep], k)
+
+
+def rank_profiles_batch(index, query_embs, locations, k):
+    """rank_profiles for each query, given (lat, lon, radius_m) `locations`.
+    Queries without a location are scored together by index.search_batch;
+    location-bound ones score their own radius."""
+    ranked = [None] * len(locations)
+    unbound = [i for i, (lat, lon, _) in enumerate(locations) if lat is None or lon is None]
+    if unbound and len(index):
+        for i, found in zip(unbound, index.search_batch(query_embs[unbound], k)):
+            ranked[i] = ranked_from_search(index, found, k)
+    for i, (lat, lon, radius_m) in enumerate(locations):
+        if ranked[i] is None:
+            ranked[i] = rank_profiles(index, query_embs[i], lat, lon, k, radius_m)
+    return ranked
@@ -0,0 +1,50 @@
+import sys
+import types
+
+import pytest
+
+import geocoding
+
+
+class FakeGeocoder:
+    def __init__(self):
+        self.calls = []
+
+    def geocode(self, phrase):
+        self.calls.append(phrase)
+        return types.SimpleNamespace(latitude=16.8, longitude=-3.0)
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    fake = FakeGeocoder()
+    geopy = types.ModuleType("geopy.geocoders")
+    geopy.Nominatim = lambda **kwargs: fake
+    monkeypatch.setitem(sys.modules, "geopy", types.ModuleType("geopy"))
+    monkeypatch.setitem(sys.modules, "geopy.geocoders", geopy)
+    monkeypatch.setattr(geocoding, "GEOCODE_REMOTE", True)
+    monkeypatch.setattr(geocoding, "_remote", fake)
+    monkeypatch.setattr(geocoding, "_cache", geocoding.LRUCache())
+    return fake
+
+
+@pytest.mark.parametrize("query", [
+    "temperature in march 2023",
+    "salinity at depth",
+    "oxygen levels in summer",
+    "pressure around 2000 dbar",
+    "temperature in the last week",
+])
+def test_time_and_depth_phrases_are_not_geocoded(remote, query):
+    assert geocoding.geocode_place(query) == geocoding.NO_LOCATION
+    assert remote.calls == []
+
+
+def test_place_after_a_time_phrase_is_geocoded(remote):
+    assert geocoding.geocode_place("salinity in march near timbuktu") == (16.8, -3.0, None)
+    assert remote.calls == ["timbuktu"]
+
+
+def test_ocean_basins_have_no_location(remote):
+    assert geocoding.geocode_place("oxygen levels in the pacific") == geocoding.NO_LOCATION
+    assert remote.calls == []
@@ -0,0 +1,50 @@
+import numpy as np
+
+from profile_index import ProfileIndex, normalize
+from ranking import rank_profiles
+
+N, DIM = 200, 16
+
+
+def make_index(deleted):
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(N, DIM)).astype(np.float32)
+    lats = rng.uniform(-0.2, 0.2, N)
+    lons = rng.uniform(-0.2, 0.2, N)
+
+    def exact(profile_ids):
+        return [None if i in deleted else embeddings[i] for i in profile_ids]
+
+    index = ProfileIndex(np.arange(N), lats, lons, [None] * N, embeddings,
+                         precision="int8", rescore=4, exact=exact)
+    return index, embeddings
+
+
+def test_search_rescores_and_drops_deleted_profiles():
+    query = np.random.default_rng(1).normal(size=DIM)
+    full, _ = make_index(deleted=set())
+    deleted = {row for row, _ in full.search(query, 3)[:2]}
+    index, embeddings = make_index(deleted)
+
+    found = index.search(query, 3)
+    assert len(found) == 3
+    exact = normalize(embeddings) @ normalize(query)
+    for row, sim in found:
+        assert row not in deleted
+        assert np.isclose(sim, exact[row], atol=1e-5)
+
+
+def test_rank_profiles_with_radius_skips_deleted_profiles():
+    query = np.random.default_rng(2).normal(size=DIM)
+    full, _ = make_index(deleted=set())
+    deleted = {profile_id for _, profile_id, *_ in rank_profiles(full, query, 0.0, 0.0, 3)[:2]}
+    index, _ = make_index(deleted)
+
+    ranked = rank_profiles(index, query, 0.0, 0.0, 3)
+    assert len(ranked) == 3
+    assert not deleted & {profile_id for _, profile_id, *_ in ranked}
+
+
+def test_search_with_every_candidate_deleted_returns_nothing():
+    index, _ = make_index(deleted=set(range(N)))
+    assert index.search(np.ones(DIM), 3) == []
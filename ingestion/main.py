@@ -1,8 +1,20 @@
+import hashlib
+import io
+import json
+import multiprocessing
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+import numpy as np
 import xarray as xr
 import pandas as pd
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2.extras import execute_batch, execute_values
 from sentence_transformers import SentenceTransformer
 import math
 
@@ -15,52 +27,667 @@ DB_CONFIG = {
 
 DATA_DIR = "./data"
 
+# Profiles are embedded in windows of EMBED_WINDOW descriptions (0 = whole
+# file), EMBED_BATCH_SIZE sentences per forward pass of the encoder.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 256))
+EMBED_WINDOW = int(os.getenv("EMBED_WINDOW", 0))
+
+# COPY FROM STDIN bulk load (default) or the row-by-row INSERT path.
+USE_COPY = os.getenv("INGEST_USE_COPY", "1") == "1"
+
+# Memory ceiling for one chunk of profiles read from a NetCDF file. The
+# per-row costs are rough sizes of a level row as a Python tuple plus its
+# COPY text, and of one profile's embedding list and its packed copy.
+INGEST_CHUNK_MB = float(os.getenv("INGEST_CHUNK_MB", 64))
+LEVEL_ROW_BYTES = 400
+PROFILE_BYTES = 16_000
+
+# Pipeline between the decode, embed and write stages of ingest_nc_file:
+# thread counts for the first two stages (the writer is the caller's
+# connection; use INGEST_WORKERS for more writers), and the number of
+# windows allowed between decode and write at any time.
+PIPELINE_DECODE_THREADS = int(os.getenv("PIPELINE_DECODE_THREADS", 1))
+PIPELINE_EMBED_THREADS = int(os.getenv("PIPELINE_EMBED_THREADS", 1))
+PIPELINE_MAX_IN_FLIGHT = int(os.getenv("PIPELINE_MAX_IN_FLIGHT", 4))
+
+# Profiles per transaction (0 = one transaction per file). Every commit also
+# checkpoints the file's manifest row so an interrupted run can resume.
+COMMIT_EVERY = int(os.getenv("INGEST_COMMIT_EVERY", 0))
+
+# Number of worker processes for process_all_files (1 = serial, in-process).
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 1))
+
+# Run report written as JSON at the end of process_all_files ("" = none) and
+# the interval for progress lines during a run (0 = off).
+REPORT_PATH = os.getenv("INGEST_REPORT", "ingest_report.json")
+PROGRESS_EVERY = float(os.getenv("INGEST_PROGRESS_SECONDS", 0))
+
+# Embeddings are stored as bytea of packed little-endian float32, which the
+# API decodes with np.frombuffer. Older tables with a JSON/array column are
+# converted by ensure_schema, MIGRATE_BATCH rows per round trip.
+EMBEDDING_DTYPE = np.dtype("<f4")
+MIGRATE_BATCH = int(os.getenv("INGEST_MIGRATE_BATCH", 5000))
+
+PROFILE_COLUMNS = ("id", "n_prof", "juld", "latitude", "longitude", "embedding")
+LEVEL_COLUMNS = ("profile_id", "n_levels", "pres", "temp", "psal", "juld")
+
 
 model = SentenceTransformer('all-MiniLM-L6-v2')  
-def get_embedding(text):
-    return model.encode(text).tolist()  
+def get_embeddings(texts, batch_size=EMBED_BATCH_SIZE):
+    return model.encode(texts, batch_size=batch_size, show_progress_bar=False).tolist()
+
+
+def pack_embedding(vector):
+    return np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def describe_profile(lat, lon, juld):
+    return f"Ocean profile at lat {lat}, lon {lon}, date {juld.strftime('%Y-%m-%d')}"
+
+
+def extract_profiles(ds, start=0):
+    """Read the per-file variables as whole arrays, one read per variable.
+    `start` is the N_PROF index of the first profile in `ds`."""
+    return {
+        "n_prof": np.arange(start, start + ds.sizes["N_PROF"]),
+        "juld": pd.to_datetime(ds["JULD"].values).to_pydatetime(),
+        "lat": ds["LATITUDE"].values.astype(float),
+        "lon": ds["LONGITUDE"].values.astype(float),
+        "pres": ds["PRES"].values.astype(float),
+        "temp": ds["TEMP"].values.astype(float),
+        "psal": ds["PSAL"].values.astype(float),
+    }
+
+
+def profiles_per_chunk(n_levels, max_mb=INGEST_CHUNK_MB):
+    per_profile = n_levels * LEVEL_ROW_BYTES + PROFILE_BYTES
+    return max(1, int(max_mb * 2**20 // per_profile))
+
+
+def plan_windows(start, n_prof, size, commit_every=0):
+    """Split profiles start..n_prof into the (lo, hi) ranges the pipeline
+    moves: at most `size` long, and (with commit_every) never crossing a
+    multiple of commit_every counted from `start`, so that every commit
+    falls exactly on one."""
+    windows = []
+    lo = start
+    while lo < n_prof:
+        hi = min(lo + size, n_prof)
+        if commit_every:
+            hi = min(hi, start + ((lo - start) // commit_every + 1) * commit_every)
+        windows.append((lo, hi))
+        lo = hi
+    return windows
+
+
+def build_level_rows(profile_ids, data, start=0):
+    """Flatten the (N_PROF, N_LEVELS) arrays into profile_levels rows for
+    the profiles start .. start + len(profile_ids)."""
+    stop = start + len(profile_ids)
+    n_levels = data["pres"].shape[1]
+    ids = np.repeat(np.asarray(profile_ids), n_levels)
+    levels = np.tile(np.arange(n_levels), len(profile_ids))
+    juld = np.repeat(np.asarray(data["juld"][start:stop], dtype=object), n_levels)
+    return list(zip(
+        ids.tolist(),
+        levels.tolist(),
+        data["pres"][start:stop].ravel().tolist(),
+        data["temp"][start:stop].ravel().tolist(),
+        data["psal"][start:stop].ravel().tolist(),
+        juld.tolist(),
+    ))
+
+
+def allocate_profile_ids(cur, count):
+    """Reserve `count` ids from the profiles sequence in one round trip."""
+    cur.execute(
+        "SELECT nextval(pg_get_serial_sequence('profiles', 'id')) FROM generate_series(1, %s)",
+        (count,),
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bytes):
+        return "\\\\x" + value.hex()
+    if isinstance(value, list):
+        return "{" + ",".join(map(str, value)) + "}"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
 
+def copy_rows(cur, table, columns, rows):
+    """Stream rows into `table` with COPY FROM STDIN through an in-memory buffer."""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(map(_copy_value, row)))
+        buf.write("\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
 
-def ingest_nc_file(file_path, conn):
-    ds = xr.open_dataset(file_path)
 
-    for prof in range(ds.sizes["N_PROF"]):
-        juld = pd.to_datetime(ds['JULD'][prof].values).to_pydatetime()
-        lat = float(ds['LATITUDE'][prof].values)
-        lon = float(ds['LONGITUDE'][prof].values)
+def copy_profiles(conn, data, embeddings):
+    """Bulk path: pre-allocate ids, then COPY profiles and profile_levels."""
+    with conn.cursor() as cur:
+        profile_ids = allocate_profile_ids(cur, len(embeddings))
+        profile_rows = list(zip(
+            profile_ids,
+            data["n_prof"].tolist(),
+            data["juld"],
+            data["lat"].tolist(),
+            data["lon"].tolist(),
+            map(pack_embedding, embeddings),
+        ))
+        copy_rows(cur, "profiles", PROFILE_COLUMNS, profile_rows)
 
-        desc = f"Ocean profile at lat {lat}, lon {lon}, date {juld.strftime('%Y-%m-%d')}"
-        emb = get_embedding(desc)
+        level_rows = build_level_rows(profile_ids, data)
+        copy_rows(cur, "profile_levels", LEVEL_COLUMNS, level_rows)
+
+    return profile_ids
+
+
+def insert_profiles(conn, data, embeddings):
+    """Row-by-row path: one INSERT ... RETURNING id per profile."""
+    profile_ids = []
+    for i, emb in enumerate(embeddings):
+        prof = int(data["n_prof"][i])
+        juld = data["juld"][i]
+        lat = float(data["lat"][i])
+        lon = float(data["lon"][i])
 
         with conn.cursor() as cur:
             cur.execute("""
                 INSERT INTO profiles (N_PROF, JULD, LATITUDE, LONGITUDE, embedding)
                 VALUES (%s, %s, %s, %s, %s) RETURNING id
-            """, (prof, juld, lat, lon, emb))
+            """, (prof, juld, lat, lon, pack_embedding(emb)))
             profile_id = cur.fetchone()[0]
+            profile_ids.append(profile_id)
 
-        level_rows = [
-            (profile_id, int(level), 
-             float(ds['PRES'][prof, level].values),
-             float(ds['TEMP'][prof, level].values),
-             float(ds['PSAL'][prof, level].values),juld)
-            for level in range(ds.sizes["N_LEVELS"])
-        ]
+        level_rows = build_level_rows([profile_id], data, start=i)
         with conn.cursor() as cur:
             execute_batch(cur, """
                 INSERT INTO profile_levels (profile_id, N_LEVELS, PRES, TEMP, PSAL,juld)
                 VALUES (%s, %s, %s, %s, %s,%s)
             """, level_rows, page_size=500)
 
+    return profile_ids
+
+
+class IngestStats:
+    """Counters and per-stage busy time for an ingest run or a single file.
+
+    Stage seconds are summed over threads, so with several decoder or encoder
+    threads they can exceed wall time. Thread-safe; `progress_every` > 0
+    prints a progress line at most that often."""
+
+    STAGES = ("decode", "embed", "write")
+
+    def __init__(self, label="run", progress_every=0):
+        self.label = label
+        self.progress_every = progress_every
+        self.started = time.perf_counter()
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.files = {}
+        self.profiles = 0
+        self.levels = 0
+        self.stage_seconds = dict.fromkeys(self.STAGES, 0.0)
+        self._lock = threading.Lock()
+        self._last_progress = self.started
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stage_seconds[name] += time.perf_counter() - started
+
+    def timed(self, name, fn):
+        def run(*args):
+            with self.stage(name):
+                return fn(*args)
+        return run
+
+    def add_rows(self, profiles, levels):
+        with self._lock:
+            self.profiles += profiles
+            self.levels += levels
+        self.maybe_progress()
+
+    def add_file(self, result):
+        """Fold a per-file result from ingest_file into the run totals."""
+        with self._lock:
+            self.files[result["status"]] = self.files.get(result["status"], 0) + 1
+            self.profiles += result["profiles"]
+            self.levels += result["levels"]
+            for name, seconds in result["stage_seconds"].items():
+                self.stage_seconds[name] += seconds
+        self.maybe_progress()
+
+    def maybe_progress(self):
+        now = time.perf_counter()
+        if self.progress_every <= 0 or now - self._last_progress < self.progress_every:
+            return
+        self._last_progress = now
+        elapsed = now - self.started
+        files = f"{sum(self.files.values())} files, " if self.files else ""
+        print(f"[{self.label}] {files}{self.profiles} profiles "
+              f"({self.profiles / elapsed:.1f}/s), {self.levels} levels "
+              f"({self.levels / elapsed:.1f}/s) after {elapsed:.0f}s")
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        n_files = sum(self.files.values())
+        return {
+            "started_at": self.started_at,
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+            "wall_seconds": round(elapsed, 3),
+            "files": {"total": n_files, **self.files},
+            "profiles": self.profiles,
+            "levels": self.levels,
+            "files_per_sec": round(n_files / elapsed, 3) if elapsed else 0.0,
+            "profiles_per_sec": round(self.profiles / elapsed, 3) if elapsed else 0.0,
+            "levels_per_sec": round(self.levels / elapsed, 3) if elapsed else 0.0,
+            "stage_seconds": {k: round(v, 3) for k, v in self.stage_seconds.items()},
+        }
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _stage_worker(fn, in_q, out_q, stop, errors, before=None):
+    """Run one pipeline stage: apply fn to each (seq, payload) from in_q and
+    pass the result on, until the pipeline is stopped."""
+    try:
+        while not stop.is_set():
+            if before is not None and not before():
+                continue
+            item = _get(in_q, stop)
+            if item is None:
+                break
+            seq, payload = item
+            _put(out_q, (seq, fn(payload)), stop)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+
+
+def decode_window(ds, bounds):
+    lo, hi = bounds
+    data = extract_profiles(ds.isel(N_PROF=slice(lo, hi)), start=lo)
+    descs = [describe_profile(lat, lon, juld) for lat, lon, juld
+             in zip(data["lat"].tolist(), data["lon"].tolist(), data["juld"])]
+    return data, descs
+
+
+def embed_window(payload):
+    data, descs = payload
+    return data, get_embeddings(descs)
+
+
+def ingest_nc_file(file_path, conn, source=None, resume_from=0, stats=None):
+    """Load profiles resume_from.. of `file_path`, committing every
+    COMMIT_EVERY profiles (0 = once per file). With a manifest `source`,
+    each commit also checkpoints the last committed profile.
+
+    Decoding, embedding and writing run as a pipeline: decoder and encoder
+    threads feed the writer (this thread, on `conn`) through queues, with
+    at most PIPELINE_MAX_IN_FLIGHT windows of at most INGEST_CHUNK_MB each
+    held in memory at once. Windows are written in file order. Stage times
+    and row counts are recorded on `stats`."""
+    load = copy_profiles if USE_COPY else insert_profiles
+    stats = stats or IngestStats(label=file_path)
+
+    with xr.open_dataset(file_path, cache=False) as ds:
+        n_prof = ds.sizes["N_PROF"]
+        n_levels = ds.sizes["N_LEVELS"]
+        commit_every = COMMIT_EVERY or max(n_prof, 1)
+        size = min(EMBED_WINDOW or commit_every, commit_every, profiles_per_chunk(n_levels))
+        windows = plan_windows(resume_from, n_prof, size, commit_every)
+
+        tasks = queue.Queue()
+        for seq, bounds in enumerate(windows):
+            tasks.put((seq, bounds))
+        decoded = queue.Queue()
+        embedded = queue.Queue()
+        in_flight = threading.Semaphore(PIPELINE_MAX_IN_FLIGHT)
+        stop = threading.Event()
+        errors = []
+
+        threads = [
+            threading.Thread(
+                target=_stage_worker,
+                args=(stats.timed("decode", partial(decode_window, ds)), tasks, decoded, stop, errors),
+                kwargs={"before": partial(in_flight.acquire, timeout=0.1)},
+                daemon=True,
+            )
+            for _ in range(PIPELINE_DECODE_THREADS)
+        ] + [
+            threading.Thread(
+                target=_stage_worker,
+                args=(stats.timed("embed", embed_window), decoded, embedded, stop, errors),
+                daemon=True,
+            )
+            for _ in range(PIPELINE_EMBED_THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            committed = resume_from
+            profile_ids = []
+            pending = {}
+            for seq in range(len(windows)):
+                while seq not in pending:
+                    item = _get(embedded, stop)
+                    if item is None:
+                        raise errors[0]
+                    pending[item[0]] = item[1]
+                data, embeddings = pending.pop(seq)
+                with stats.stage("write"):
+                    profile_ids += load(conn, data, embeddings)
+                in_flight.release()
+
+                done = windows[seq][1]
+                if done < n_prof and done - committed >= commit_every:
+                    with stats.stage("write"):
+                        commit_checkpoint(conn, source, done - 1, profile_ids, complete=False)
+                    committed, profile_ids = done, []
+                stats.add_rows(len(embeddings), len(embeddings) * n_levels)
+            with stats.stage("write"):
+                commit_checkpoint(conn, source, n_prof - 1, profile_ids, complete=True)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    ingested = max(n_prof - resume_from, 0)
+    return {"profiles": ingested, "levels": ingested * n_levels}
+
+
+def ensure_schema(conn):
+    """Create the ingest manifest and the indexes the API's bounding-box and
+    depth-level queries use, if they are missing."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS profiles_lat_lon_idx ON profiles (latitude, longitude)"
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS profile_levels_profile_level_idx "
+            "ON profile_levels (profile_id, n_levels)"
+        )
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_manifest (
+                path TEXT PRIMARY KEY,
+                size BIGINT NOT NULL,
+                mtime DOUBLE PRECISION NOT NULL,
+                sha256 TEXT NOT NULL,
+                profile_ids BIGINT[] NOT NULL DEFAULT '{}',
+                ingested_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+        cur.execute("""
+            ALTER TABLE ingest_manifest
+                ADD COLUMN IF NOT EXISTS last_profile INTEGER NOT NULL DEFAULT -1,
+                ADD COLUMN IF NOT EXISTS complete BOOLEAN NOT NULL DEFAULT TRUE
+        """)
+    conn.commit()
+    migrate_embeddings(conn)
+
+
+def migrate_embeddings(conn, batch_size=MIGRATE_BATCH):
+    """Convert a JSON/array profiles.embedding column to packed float32 bytea
+    in place: backfill a new column in batches, then swap it in. A no-op once
+    the column is bytea."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'profiles' AND column_name = 'embedding'
+        """)
+        row = cur.fetchone()
+        if row is None or row[0] == "bytea":
+            return
+        cur.execute("ALTER TABLE profiles ADD COLUMN IF NOT EXISTS embedding_f32 BYTEA")
+    conn.commit()
+
+    migrated = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, embedding FROM profiles
+                WHERE embedding_f32 IS NULL AND embedding IS NOT NULL
+                LIMIT %s
+            """, (batch_size,))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            packed = [
+                (profile_id, pack_embedding(json.loads(emb) if isinstance(emb, str) else emb))
+                for profile_id, emb in rows
+            ]
+            execute_values(cur, """
+                UPDATE profiles SET embedding_f32 = v.emb
+                FROM (VALUES %s) AS v (id, emb)
+                WHERE profiles.id = v.id
+            """, packed, page_size=1000)
         conn.commit()
-        print(f"Inserted profile {prof} with {len(level_rows)} levels")
+        migrated += len(rows)
+        print(f"Migrated {migrated} embeddings to float32")
+
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE profiles DROP COLUMN embedding")
+        cur.execute("ALTER TABLE profiles RENAME COLUMN embedding_f32 TO embedding")
+    conn.commit()
+
+
+def file_sha256(file_path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+MANIFEST_FIELDS = ("size", "mtime", "sha256", "profile_ids", "last_profile", "complete")
+
+
+def get_manifest_entry(conn, path):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT {', '.join(MANIFEST_FIELDS)} FROM ingest_manifest WHERE path = %s",
+            (path,),
+        )
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return dict(zip(MANIFEST_FIELDS, row))
+
+
+def remove_file_profiles(conn, path, profile_ids):
+    """Drop everything a previous ingest of `path` produced, in one transaction."""
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM profile_levels WHERE profile_id = ANY(%s)", (profile_ids,))
+        cur.execute("DELETE FROM profiles WHERE id = ANY(%s)", (profile_ids,))
+        cur.execute("DELETE FROM ingest_manifest WHERE path = %s", (path,))
+    conn.commit()
+
+
+def touch_manifest(conn, source):
+    with conn.cursor() as cur:
+        cur.execute("UPDATE ingest_manifest SET mtime = %s WHERE path = %s",
+                    (source["mtime"], source["path"]))
+    conn.commit()
+
+
+def commit_checkpoint(conn, source, last_profile, profile_ids, complete):
+    """Commit the open transaction together with the manifest checkpoint for
+    `source`, appending the profile ids written since the previous one."""
+    if source is not None:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO ingest_manifest
+                    (path, size, mtime, sha256, profile_ids, last_profile, complete)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (path) DO UPDATE SET
+                    size = EXCLUDED.size,
+                    mtime = EXCLUDED.mtime,
+                    sha256 = EXCLUDED.sha256,
+                    profile_ids = ingest_manifest.profile_ids || EXCLUDED.profile_ids,
+                    last_profile = EXCLUDED.last_profile,
+                    complete = EXCLUDED.complete,
+                    ingested_at = now()
+            """, (source["path"], source["size"], source["mtime"], source["sha256"],
+                  profile_ids, last_profile, complete))
+    conn.commit()
+
+
+def ingest_file(file_path, conn):
+    """Ingest one file unless the manifest shows it unchanged, resuming from
+    the last checkpoint of an interrupted run, and report the outcome
+    instead of raising."""
+    stats = IngestStats(label=file_path, progress_every=PROGRESS_EVERY)
+    path = os.path.abspath(file_path)
+    counts = {"profiles": 0, "levels": 0}
+    error = None
+    try:
+        stat = os.stat(path)
+        entry = get_manifest_entry(conn, path)
+        if (entry and entry["complete"] and entry["size"] == stat.st_size
+                and entry["mtime"] == stat.st_mtime):
+            status = "skipped"
+        else:
+            source = {"path": path, "size": stat.st_size, "mtime": stat.st_mtime,
+                      "sha256": file_sha256(path)}
+            resume_from = 0
+            if entry is None:
+                status = "ingested"
+            elif entry["sha256"] != source["sha256"]:
+                remove_file_profiles(conn, path, entry["profile_ids"])
+                status = "replaced"
+            elif entry["complete"]:
+                # Touched but not modified: remember the new mtime and move on.
+                touch_manifest(conn, source)
+                status = "skipped"
+            else:
+                resume_from = entry["last_profile"] + 1
+                status = "resumed"
+            if status != "skipped":
+                counts = ingest_nc_file(path, conn, source, resume_from, stats)
+    except Exception as e:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass  # connection lost; the original error is what gets reported
+        counts = {"profiles": 0, "levels": 0}
+        status = "failed"
+        error = str(e)
+    return file_result(file_path, status, counts, stats, error)
+
+
+def file_result(file_path, status, counts, stats, error=None):
+    return {"file": file_path, "status": status, **counts,
+            "seconds": time.perf_counter() - stats.started,
+            "stage_seconds": stats.stage_seconds, "error": error}
+
+
+def ingest_file_worker(file_path):
+    """Process-pool entry point: each worker uses its own DB connection. A
+    connection failure is reported like any other failed file."""
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+    except psycopg2.Error as e:
+        return file_result(file_path, "failed", {"profiles": 0, "levels": 0},
+                           IngestStats(label=file_path), str(e))
+    try:
+        return ingest_file(file_path, conn)
+    finally:
+        conn.close()
+
+
+def _init_worker(workers):
+    # Split the cores between workers so the encoders don't oversubscribe them.
+    import torch
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+
+
+def list_nc_files(data_dir=DATA_DIR):
+    return sorted(os.path.join(data_dir, f) for f in os.listdir(data_dir) if f.endswith(".nc"))
+
+
+def report_file(result):
+    if result["error"]:
+        print(f"FAILED {result['file']}: {result['error']}")
+    elif result["status"] != "skipped":
+        print(f"{result['status'].capitalize()} {result['file']}: {result['profiles']} profiles, "
+              f"{result['levels']} levels in {result['seconds']:.1f}s")
+
+
+def write_run_report(stats, results, workers, path=REPORT_PATH):
+    report = {
+        **stats.as_dict(),
+        "workers": workers,
+        "failures": [{"file": r["file"], "error": r["error"]} for r in results if r["error"]],
+        "per_file": results,
+    }
+    if path:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def process_all_files(workers=INGEST_WORKERS):
+    files = list_nc_files()
+    results = []
+    stats = IngestStats(progress_every=PROGRESS_EVERY)
 
-def process_all_files():
     conn = psycopg2.connect(**DB_CONFIG)
-    for file in os.listdir(DATA_DIR):
-        if file.endswith(".nc"):
-            ingest_nc_file(os.path.join(DATA_DIR, file), conn)
-    conn.close()
+    ensure_schema(conn)
+
+    if workers <= 1:
+        for file_path in files:
+            results.append(ingest_file(file_path, conn))
+            stats.add_file(results[-1])
+            report_file(results[-1])
+        conn.close()
+    else:
+        conn.close()
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(workers,),
+        ) as pool:
+            for future in as_completed([pool.submit(ingest_file_worker, f) for f in files]):
+                results.append(future.result())
+                stats.add_file(results[-1])
+                report_file(results[-1])
+
+    report = write_run_report(stats, results, workers)
+    print(f"Processed {report['files']['total']} files "
+          f"({report['files'].get('skipped', 0)} unchanged, {len(report['failures'])} failed) "
+          f"with {workers} worker(s): {report['profiles']} profiles "
+          f"({report['profiles_per_sec']}/s), {report['levels']} levels "
+          f"({report['levels_per_sec']}/s) in {report['wall_seconds']}s")
+    return report
 
 if __name__ == "__main__":
     process_all_files()
@@ -1,5 +1,7 @@
 
+import io
 import os
+import numpy as np
 import xarray as xr
 import pandas as pd
 import psycopg2
@@ -7,6 +9,8 @@ from psycopg2.extras import execute_batch
 
 DATA_DIR = "../data" 
 BULK_SIZE = 1000     
+USE_COPY = os.getenv("INGEST_USE_COPY", "1") == "1"
+CHUNK_MB = float(os.getenv("INGEST_CHUNK_MB", 256))
 DB_CONFIG = {
     "host": "localhost",
     "database": "floatchatai",
@@ -17,23 +21,73 @@ DB_CONFIG = {
 LAT_RANGE = (-10, 30)
 TIME_START = "2023-01-01"
 TIME_END = "2023-06-30"
+COLUMNS = ['float_id', 'time', 'lat', 'lon', 'temp', 'salinity']
 
 def connect_db():
     return psycopg2.connect(**DB_CONFIG)
 
+def chunk_length(ds, dim, max_mb=CHUNK_MB):
+    """Number of steps along `dim` whose flattened DataFrame fits in max_mb."""
+    rows_per_step = 1
+    for other, size in ds.sizes.items():
+        if other != dim:
+            rows_per_step *= size
+    row_bytes = (len(ds.data_vars) + len(ds.dims)) * 8 * 2
+    return max(1, int(max_mb * 2**20 // (rows_per_step * row_bytes)))
+
+def _select(ds, name, mask):
+    dim = ds[name].dims[0]
+    return ds.isel({dim: np.flatnonzero(mask)})
+
+def push_down(ds):
+    """Apply the variable selection and the 1-D lat/time filters on the lazy
+    dataset, so only the wanted variables and index ranges are ever read."""
+    ds = ds[[c for c in COLUMNS if c in ds.data_vars]]
+    if 'lat' in ds.variables and ds['lat'].ndim == 1:
+        lat = ds['lat'].values
+        ds = _select(ds, 'lat', (lat >= LAT_RANGE[0]) & (lat <= LAT_RANGE[1]))
+    if 'time' in ds.variables and ds['time'].ndim == 1:
+        time = ds['time'].values
+        ds = _select(ds, 'time', (time >= np.datetime64(TIME_START)) & (time <= np.datetime64(TIME_END)))
+    return ds
+
+def iter_chunks(ds):
+    # Nothing left after push_down (none of COLUMNS in the file): no chunks.
+    if not ds.data_vars or not ds.dims:
+        return
+    dim = "time" if "time" in ds.dims else next(iter(ds.dims))
+    step = chunk_length(ds, dim)
+    for start in range(0, ds.sizes[dim], step):
+        yield ds.isel({dim: slice(start, start + step)})
+
 def preprocess_file(file_path):
+    """Yield the filtered rows of `file_path` one bounded-size chunk at a time."""
     print(f"Processing {file_path}...")
-    ds = xr.open_dataset(file_path, chunks={'time': 1000})
-    df = ds.to_dataframe().reset_index()
-    
-    if 'lat' in df.columns:
-        df = df[df['lat'].between(LAT_RANGE[0], LAT_RANGE[1])]
-    if 'time' in df.columns:
-        df = df[(df['time'] >= pd.Timestamp(TIME_START)) & (df['time'] <= pd.Timestamp(TIME_END))]
-    
-    columns = ['float_id', 'time', 'lat', 'lon', 'temp', 'salinity']
-    df = df[[c for c in columns if c in df.columns]]
-    return df
+    with xr.open_dataset(file_path, cache=False) as ds:
+        for chunk in iter_chunks(push_down(ds)):
+            df = chunk.to_dataframe().reset_index()
+
+            # Exact filters for lat/time that were not 1-D and so could not be
+            # pushed down; a no-op for the rows push_down already selected.
+            if 'lat' in df.columns:
+                df = df[df['lat'].between(LAT_RANGE[0], LAT_RANGE[1])]
+            if 'time' in df.columns:
+                df = df[(df['time'] >= pd.Timestamp(TIME_START)) & (df['time'] <= pd.Timestamp(TIME_END))]
+
+            yield df[[c for c in COLUMNS if c in df.columns]]
+
+def copy_to_postgres(df, conn):
+    cur = conn.cursor()
+    buf = io.StringIO()
+    # CSV on both sides, so COPY parses to_csv's quoting. NaN/NaT go in as
+    # NULL (unquoted \N), the same as insert_to_postgres loads them.
+    df.to_csv(buf, header=False, index=False, na_rep="\\N")
+    buf.seek(0)
+    cur.copy_expert(
+        f"COPY argo_data ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf
+    )
+    conn.commit()
+    cur.close()
 
 def insert_to_postgres(df, conn):
     cur = conn.cursor()
@@ -41,7 +95,7 @@ def insert_to_postgres(df, conn):
     INSERT INTO argo_data (float_id, time, lat, lon, temp, salinity)
     VALUES (%s,%s,%s,%s,%s,%s)
     """
-    records = df.to_records(index=False)
+    records = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
     execute_batch(cur, sql, records, page_size=BULK_SIZE)
     conn.commit()
     cur.close()
@@ -51,10 +105,14 @@ def process_all():
     files = [f for f in os.listdir(DATA_DIR) if f.endswith(".nc")]
     
     for file in files:
-        df = preprocess_file(os.path.join(DATA_DIR, file))
-        if not df.empty:
-            insert_to_postgres(df, conn)
-            print(f"Inserted {len(df)} rows from {file}")
+        inserted = 0
+        for df in preprocess_file(os.path.join(DATA_DIR, file)):
+            if not df.empty:
+                load = copy_to_postgres if USE_COPY else insert_to_postgres
+                load(df, conn)
+                inserted += len(df)
+        if inserted:
+            print(f"Inserted {inserted} rows from {file}")
         else:
             print(f"No relevant data in {file}")
     